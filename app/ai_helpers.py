@@ -11,9 +11,16 @@ Provides simple, convenient functions for AI assistants to:
 This is the main interface AI assistants should use.
 """
 
+import json
 import requests
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # Optional dependency - fall back to stdlib json
+    orjson = None
 
 from app.context_formatters import (
     format_code_context,
@@ -29,6 +36,28 @@ from app.prompts import (
 )
 
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def to_json_bytes(payload: Any) -> bytes:
+    """Serialize an API payload to UTF-8 JSON bytes for a request body
+    
+    Pydantic models are encoded directly by pydantic-core (no intermediate
+    dict); plain dicts go through orjson when installed, stdlib json otherwise.
+    
+    Args:
+        payload: Pydantic model or JSON-compatible dict
+        
+    Returns:
+        Compact JSON bytes
+    """
+    if isinstance(payload, BaseModel):
+        return payload.model_dump_json().encode("utf-8")
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
 class MemoryLayerClient:
     """Client for interacting with the Memory Layer API"""
     
@@ -75,7 +104,8 @@ class MemoryLayerClient:
         try:
             response = requests.post(
                 f"{self.base_url}/search/code",
-                json=payload,
+                data=to_json_bytes(payload),
+                headers=JSON_HEADERS,
                 timeout=30
             )
             response.raise_for_status()
@@ -141,7 +171,8 @@ class MemoryLayerClient:
         try:
             response = requests.post(
                 f"{self.base_url}/ingest/code-context",
-                json=payload,
+                data=to_json_bytes(payload),
+                headers=JSON_HEADERS,
                 timeout=30
             )
             response.raise_for_status()
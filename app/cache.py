@@ -1,16 +1,51 @@
 # app/cache.py
 import hashlib
 import json
+import logging
+import os
 import time
+from collections import OrderedDict
 from functools import lru_cache, wraps
 from typing import Any, Dict, List, Optional, Union
 from datetime import datetime, timedelta
 
-# In-memory cache với TTL (Time To Live)
+try:
+    import xxhash
+except ImportError:  # Optional dependency - fall back to hashlib
+    xxhash = None
+
+try:
+    import orjson
+except ImportError:  # Optional dependency - fall back to stdlib json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize JSON (sắp xếp key) thành bytes; dùng orjson nếu có"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, sort_keys=True, default=str).encode()
+
+def _digest(text: Union[str, bytes]) -> str:
+    """Băm nhanh (không cần an toàn mật mã) để làm cache key"""
+    data = text if isinstance(text, bytes) else text.encode()
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.md5(data).hexdigest()
+
+# In-memory cache với TTL (Time To Live), giới hạn số entry theo LRU
 class MemoryCache:
-    def __init__(self, default_ttl: int = 3600):  # 1 hour default
-        self.cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, default_ttl: int = 3600, max_entries: int = 1024):  # 1 hour default
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        # Index theo prefix ("search", "stats", ...) để xóa theo nhóm không phải quét toàn bộ cache
+        self._prefix_index: Dict[str, set] = {}
+    
+    @staticmethod
+    def _prefix_of(key: str) -> str:
+        return key.split(':', 1)[0]
     
     def _generate_key(self, *args, **kwargs) -> str:
         """Tạo cache key từ arguments"""
@@ -18,8 +53,7 @@ class MemoryCache:
             'args': args,
             'kwargs': sorted(kwargs.items())
         }
-        key_string = json.dumps(key_data, sort_keys=True, default=str)
-        return hashlib.md5(key_string.encode()).hexdigest()
+        return _digest(_dumps(key_data))
     
     def get(self, key: str) -> Optional[Any]:
         """Lấy giá trị từ cache"""
@@ -28,28 +62,45 @@ class MemoryCache:
         
         entry = self.cache[key]
         if time.time() > entry['expires_at']:
-            del self.cache[key]
+            self.delete(key)
             return None
         
+        # Đánh dấu vừa dùng (LRU)
+        self.cache.move_to_end(key)
         return entry['value']
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Lưu giá trị vào cache"""
         ttl = ttl or self.default_ttl
+        now = time.time()
         self.cache[key] = {
             'value': value,
-            'expires_at': time.time() + ttl,
-            'created_at': time.time()
+            'expires_at': now + ttl,
+            'created_at': now
         }
+        self.cache.move_to_end(key)
+        self._prefix_index.setdefault(self._prefix_of(key), set()).add(key)
+        
+        # Vượt giới hạn thì bỏ entry ít được dùng nhất
+        while len(self.cache) > self.max_entries:
+            oldest_key = next(iter(self.cache))
+            self.delete(oldest_key)
     
     def delete(self, key: str) -> None:
         """Xóa key khỏi cache"""
         if key in self.cache:
             del self.cache[key]
+            self._prefix_index.get(self._prefix_of(key), set()).discard(key)
+    
+    def delete_prefix(self, prefix: str) -> None:
+        """Xóa mọi key có dạng '<prefix>:...'"""
+        for key in self._prefix_index.pop(prefix, set()):
+            self.cache.pop(key, None)
     
     def clear(self) -> None:
         """Xóa toàn bộ cache"""
         self.cache.clear()
+        self._prefix_index.clear()
     
     def cleanup_expired(self) -> None:
         """Dọn dẹp các entry đã hết hạn"""
@@ -59,7 +110,7 @@ class MemoryCache:
             if current_time > entry['expires_at']
         ]
         for key in expired_keys:
-            del self.cache[key]
+            self.delete(key)
     
     def get_stats(self) -> Dict[str, Any]:
         """Lấy thống kê cache"""
@@ -75,13 +126,13 @@ class MemoryCache:
             'active_entries': total_entries - expired_entries,
             'expired_entries': expired_entries,
             'cache_size_mb': sum(
-                len(json.dumps(entry['value'], default=str).encode())
+                len(_dumps(entry['value']))
                 for entry in self.cache.values()
             ) / (1024 * 1024)
         }
 
 # Global cache instance
-memory_cache = MemoryCache(default_ttl=3600)  # 1 hour
+memory_cache = MemoryCache(default_ttl=3600, max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")))  # 1 hour
 
 def cached_with_ttl(ttl: int = 3600, key_prefix: str = ""):
     """Decorator để cache function với TTL"""
@@ -129,7 +180,7 @@ def cache_search_result(query: str, focal_node_uuid: Optional[str] = None, group
     """Cache kết quả search với TTL 30 phút"""
     # Tránh lỗi f-string lồng nhau bằng cách tạo chuỗi riêng để băm
     to_hash = f"{query}:{focal_node_uuid or ''}:{group_id or ''}"
-    digest = hashlib.md5(to_hash.encode()).hexdigest()
+    digest = _digest(to_hash)
     cache_key = f"search:{digest}"
     return cache_key
 
@@ -137,7 +188,7 @@ def cache_search_result(query: str, focal_node_uuid: Optional[str] = None, group
 @lru_cache(maxsize=1000)
 def get_embedding_cache_key(text: str) -> str:
     """Tạo cache key cho embedding"""
-    return f"embedding:{hashlib.md5(text.encode()).hexdigest()}"
+    return f"embedding:{_digest(text)}"
 
 # Cache cho node data
 def cache_node_data(node_uuid: str, ttl: int = 3600):
@@ -149,12 +200,22 @@ def cache_connections(node_uuid: str, ttl: int = 1800):
     """Cache connections của node với TTL 30 phút"""
     return f"connections:{node_uuid}"
 
+# Cache cho project stats
+def cache_project_stats(project_id: str, ttl: int = 15):
+    """Cache thống kê project với TTL ngắn 15 giây"""
+    return f"stats:{project_id}"
+
 # Utility functions
 def invalidate_search_cache():
     """Xóa tất cả search cache"""
-    keys_to_delete = [key for key in memory_cache.cache.keys() if key.startswith('search:')]
-    for key in keys_to_delete:
-        memory_cache.delete(key)
+    memory_cache.delete_prefix('search')
+
+def invalidate_stats_cache(project_id: Optional[str] = None):
+    """Xóa stats cache của một project (hoặc tất cả nếu không truyền project_id)"""
+    if project_id is not None:
+        memory_cache.delete(cache_project_stats(project_id))
+        return
+    memory_cache.delete_prefix('stats')
 
 def invalidate_node_cache(node_uuid: str):
     """Xóa cache của node cụ thể"""
@@ -166,13 +227,18 @@ def invalidate_all_cache():
     memory_cache.clear()
 
 # Cache warming functions
-async def warm_up_cache(graphiti, common_queries: List[str]):
-    """Làm nóng cache với các query phổ biến"""
-    for query in common_queries:
-        try:
-            await graphiti.search(query)
-        except Exception as e:
-            print(f"Error warming cache for query '{query}': {e}")
+async def warm_up_cache(graphiti, common_queries: List[str], max_concurrency: int = 10):
+    """Làm nóng cache với các query phổ biến (chạy song song, giới hạn bởi semaphore)"""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def _warm(query: str):
+        async with semaphore:
+            try:
+                await graphiti.search(query)
+            except Exception as e:
+                logger.warning("Error warming cache for query '%s': %s", query, e)
+    
+    await asyncio.gather(*(_warm(query) for query in common_queries))
 
 # Cache monitoring
 def get_cache_metrics() -> Dict[str, Any]:
@@ -190,7 +256,8 @@ async def auto_cleanup_cache():
     while True:
         await asyncio.sleep(600)  # 10 minutes
         memory_cache.cleanup_expired()
-        print(f"Cache cleanup completed. Stats: {memory_cache.get_stats()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Cache cleanup completed. Stats: %s", memory_cache.get_stats())
 
 # Import asyncio for async functions
 import asyncio
@@ -12,9 +12,22 @@ Design Principles:
 4. Structure - Consistent formatting for reliable parsing
 """
 
+import heapq
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+try:
+    import ciso8601
+except ImportError:  # Optional dependency - fall back to datetime.fromisoformat
+    ciso8601 = None
+
+
+def _parse_iso(timestamp: str) -> datetime:
+    """Parse ISO 8601 timestamp (C parser if ciso8601 is installed)"""
+    if ciso8601 is not None:
+        return ciso8601.parse_datetime(timestamp)
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
 
 class ContextFormatter:
     """Base formatter for memory context"""
@@ -23,7 +36,7 @@ class ContextFormatter:
     def format_timestamp(timestamp: str) -> str:
         """Format timestamp to human-readable relative time"""
         try:
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            dt = _parse_iso(timestamp)
             now = datetime.now(dt.tzinfo)
             delta = now - dt
             
@@ -147,12 +160,12 @@ class CodeContextFormatter(ContextFormatter):
         if not memories:
             return "No code context available."
         
-        # Sort by created_at (most recent first)
-        sorted_mems = sorted(
+        # Top-N by created_at (most recent first) - heap thay vì sort toàn bộ list
+        sorted_mems = heapq.nlargest(
+            limit,
             memories,
-            key=lambda m: m.get('created_at', ''),
-            reverse=True
-        )[:limit]
+            key=lambda m: m.get('created_at', '')
+        )
         
         lines = ["**Recent Code Changes:**\n"]
         for i, mem in enumerate(sorted_mems, 1):
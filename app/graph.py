@@ -1,37 +1,23 @@
 # app/graph.py
+import asyncio
 import os
-import json
+import importlib.util
+from contextlib import asynccontextmanager
 from pathlib import Path
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Any
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Any
 from dotenv import load_dotenv
 from graphiti_core import Graphiti
+from neo4j import AsyncGraphDatabase, RoutingControl
+try:
+    from graphiti_core.driver.neo4j_driver import Neo4jDriver
+except ImportError:  # graphiti_core bản cũ chưa có graph_driver
+    Neo4jDriver = None
 from app.cache import cached_with_ttl
 import logging
 
 logger = logging.getLogger(__name__)
 
-# ============================================================================
-# MONKEY PATCH: Fix Graphiti's JSON serialization for Neo4j DateTime objects
-# ============================================================================
-def _json_serializer(obj):
-    """Custom JSON serializer that handles Neo4j DateTime objects"""
-    if hasattr(obj, 'isoformat'):
-        return obj.isoformat()
-    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
-
-# Monkey patch json.dumps to use custom serializer
-_original_json_dumps = json.dumps
-
-def _patched_json_dumps(obj, **kwargs):
-    """Patched json.dumps that handles Neo4j DateTime"""
-    if 'default' not in kwargs:
-        kwargs['default'] = _json_serializer
-    return _original_json_dumps(obj, **kwargs)
-
-json.dumps = _patched_json_dumps
-# ============================================================================
-
 # Graphiti sẽ dùng mặc định OpenAI cho LLM/embeddings nếu có OPENAI_API_KEY
 # Bạn có thể truyền client tuỳ chỉnh theo LLM Configuration doc khi cần.
 
@@ -40,21 +26,196 @@ json.dumps = _patched_json_dumps
 load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env", override=True)
 
 _graphiti: Graphiti | None = None
+_graphiti_lock = asyncio.Lock()
+
+# Cấu hình connection pool cho Neo4j driver (dùng chung cho toàn app)
+NEO4J_DRIVER_CONFIG = {
+    "max_connection_pool_size": int(os.getenv("NEO4J_MAX_POOL_SIZE", "200")),
+    "connection_acquisition_timeout": float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30")),
+    # Thay connection trước khi router/load balancer cắt kết nối idle (mặc định driver là 1 giờ)
+    "max_connection_lifetime": float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "1800")),
+    "keep_alive": True,
+}
+
+# Chỉ định database cho mọi session để driver không phải hỏi server database mặc định
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE", "neo4j")
+
+# Thời gian sống (TTL) của code memories
+MEMORY_TTL_HOURS = 48
+MEMORY_TTL = timedelta(hours=MEMORY_TTL_HOURS)
+
+def _to_utc(dt: datetime) -> datetime:
+    """
+    Gắn timezone UTC cho datetime naive để driver gửi dưới dạng Bolt DateTime
+    (naive sẽ thành LocalDateTime, không so sánh được với datetime() trong Cypher)
+    """
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+def _expires_at_value(expires_at: datetime) -> str:
+    """
+    Giá trị expires_at ghi vào Neo4j: chuỗi ISO 8601 (UTC) thay vì DateTime
+
+    Graphiti đọc mọi property của entity vào attributes rồi json.dumps chúng
+    (prompt, lưu node); Neo4j DateTime không serialize được còn chuỗi thì được.
+    Các query vẫn so sánh qua datetime(e.expires_at) nên không phải đổi.
+    """
+    return _to_utc(expires_at).isoformat()
+
+def _created_entity_uuids(nodes, since: datetime) -> List[str]:
+    """
+    UUID của các entity mà episode vừa tạo mới (created_at >= since)
+
+    add_episode trả về cả những entity đã có từ trước được dedupe vào episode;
+    không được gắn TTL/project_id cho chúng, nếu không cleanup sẽ xóa mất
+    các entity lâu dài đó
+    """
+    since = _to_utc(since)
+    return [
+        node.uuid for node in (nodes or [])
+        if getattr(node, "uuid", None)
+        and isinstance(getattr(node, "created_at", None), datetime)
+        and _to_utc(node.created_at) >= since
+    ]
+
+# =============================================================================
+# Cypher queries (hằng số module: không dựng lại chuỗi mỗi lần gọi, Neo4j dùng lại query plan)
+# =============================================================================
+
+_SET_ENTITY_TTL_QUERY = """
+    MATCH (e:Entity {uuid: $uuid})
+    SET e.expires_at = $expires_at,
+        e.project_id = $project_id
+"""
+
+_SET_ENTITIES_TTL_QUERY = """
+    UNWIND $uuids AS uuid
+    MATCH (e:Entity {uuid: uuid})
+    SET e.expires_at = $expires_at,
+        e.project_id = $project_id
+"""
+
+# Gộp bước set TTL vào cùng query của add_code_metadata (count() luôn trả về 1 dòng kể cả khi UNWIND rỗng)
+_TTL_CLAUSE = """
+    UNWIND $ttl_uuids AS ttl_uuid
+    MATCH (t:Entity {uuid: ttl_uuid})
+    SET t.expires_at = $expires_at,
+        t.project_id = $project_id
+    WITH count(t) AS ttl_count
+"""
+
+_CLEANUP_EXPIRED_QUERY = """
+    MATCH (e:Entity)
+    WHERE e.expires_at IS NOT NULL 
+      AND datetime(e.expires_at) < datetime()
+    CALL {
+        WITH e
+        DETACH DELETE e
+    } IN TRANSACTIONS OF $batch_size ROWS
+    RETURN count(e) as deleted_count
+"""
+
+# Dữ liệu cũ lưu expires_at dạng DateTime: đổi sang chuỗi ISO (chuỗi thì toString giữ nguyên,
+# giá trị khác kiểu không bao giờ "=" nhau nên chỉ các DateTime bị ghi lại)
+_NORMALIZE_EXPIRES_AT_QUERY = """
+    MATCH (e:Entity)
+    WHERE e.expires_at IS NOT NULL
+      AND toString(e.expires_at) <> e.expires_at
+    SET e.expires_at = toString(e.expires_at)
+    RETURN count(e) AS converted_count
+"""
+
+# Chuyển DateTime sang chuỗi ISO ngay trong Cypher, driver trả về string luôn
+_RETURN_ENTITY_CLAUSE = """
+    RETURN e {
+        .*,
+        created_at: toString(e.created_at),
+        expires_at: toString(e.expires_at)
+    } AS e
+"""
+
+# count() luôn trả về đúng 1 dòng, kể cả khi MATCH không khớp entity nào
+_RETURN_MATCHED_CLAUSE = """
+    RETURN count(e) AS matched
+"""
+
+_PROJECT_STATS_QUERY = """
+    WITH datetime() as now
+    MATCH (e:Entity {project_id: $project_id})
+    WITH 
+        count(*) as total_count,
+        count(CASE WHEN datetime(e.expires_at) > now THEN 1 END) as active_count,
+        count(DISTINCT e.file_path) as files_count,
+        collect(DISTINCT e.change_type) as change_types
+    RETURN 
+        active_count,
+        total_count - active_count as expired_count,
+        files_count,
+        change_types
+"""
+
+async def _install_tuned_driver(graphiti: Graphiti, uri: str, user: str, password: str):
+    """
+    Thay Neo4j driver mặc định của Graphiti bằng driver có cấu hình pool rõ ràng
+    
+    Tuỳ phiên bản graphiti_core, AsyncDriver nằm ở graphiti.driver (bản cũ)
+    hoặc graphiti.driver.client (bản mới bọc trong Neo4jDriver).
+    """
+    tuned = AsyncGraphDatabase.driver(uri, auth=(user, password), **NEO4J_DRIVER_CONFIG)
+    wrapper = graphiti.driver
+    if hasattr(wrapper, "client"):
+        old_driver, wrapper.client = wrapper.client, tuned
+    else:
+        old_driver, graphiti.driver = wrapper, tuned
+        clients = getattr(graphiti, "clients", None)
+        if clients is not None and hasattr(clients, "driver"):
+            clients.driver = tuned
+    # Driver cũ chưa mở connection nào (lazy) nên đóng ngay được
+    await old_driver.close()
+    
+    # Bắt tay trước một lần để request đầu tiên không phải chịu chi phí kết nối
+    try:
+        await tuned.verify_connectivity()
+    except Exception as e:
+        logger.warning(f"Neo4j connectivity check failed: {e}")
+    
+    # neo4j-rust-ext (tuỳ chọn) tự thay PackStream codec bằng bản Rust khi được cài
+    if importlib.util.find_spec("neo4j._rust") is not None:
+        logger.info("neo4j-rust-ext detected: using Rust PackStream codec")
+    else:
+        logger.info("neo4j-rust-ext not installed: using pure-Python PackStream codec")
 
 async def get_graphiti() -> Graphiti:
     """Lấy Graphiti instance với caching"""
     global _graphiti
-    if _graphiti is None:
-        # Graphiti uses OpenAI embeddings by default (text-embedding-ada-002)
-        # To use text-embedding-3-small, set OPENAI_EMBEDDING_MODEL env var
-        # Note: Graphiti may not support custom embedding models out of the box
-        # Check Graphiti docs for embedding configuration
-        
-        _graphiti = Graphiti(
-            uri=os.getenv("NEO4J_URI", "bolt://localhost:7687"),
-            user=os.getenv("NEO4J_USER", "neo4j"),
-            password=os.getenv("NEO4J_PASSWORD", "neo4j"),
-        )
+    if _graphiti is not None:
+        return _graphiti
+    
+    # Double-checked locking: các request đồng thời lúc khởi động chỉ tạo một driver
+    async with _graphiti_lock:
+        if _graphiti is None:
+            # Graphiti uses OpenAI embeddings by default (text-embedding-ada-002)
+            # To use text-embedding-3-small, set OPENAI_EMBEDDING_MODEL env var
+            # Note: Graphiti may not support custom embedding models out of the box
+            # Check Graphiti docs for embedding configuration
+            
+            uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+            user = os.getenv("NEO4J_USER", "neo4j")
+            password = os.getenv("NEO4J_PASSWORD", "neo4j")
+            if Neo4jDriver is not None:
+                # Graphiti ghi episode vào cùng database với các query TTL/metadata/stats
+                graphiti = Graphiti(
+                    graph_driver=Neo4jDriver(uri, user, password, database=NEO4J_DATABASE)
+                )
+            else:
+                # graphiti_core bản cũ: driver luôn dùng home database của user
+                if os.getenv("NEO4J_DATABASE") not in (None, "neo4j"):
+                    logger.warning(
+                        "NEO4J_DATABASE is set but this graphiti_core version does not "
+                        "support graph_driver; episodes go to the user's home database"
+                    )
+                graphiti = Graphiti(uri=uri, user=user, password=password)
+            await _install_tuned_driver(graphiti, uri, user, password)
+            _graphiti = graphiti
     return _graphiti
 
 @cached_with_ttl(ttl=3600, key_prefix="graphiti_search")
@@ -82,6 +243,15 @@ def reset_graphiti_cache():
     global _graphiti
     _graphiti = None
 
+@asynccontextmanager
+async def _session_scope(graphiti: Graphiti, session=None):
+    """Dùng lại session của caller nếu có, nếu không thì mở session mới"""
+    if session is not None:
+        yield session
+    else:
+        async with graphiti.driver.session(database=NEO4J_DATABASE) as new_session:
+            yield new_session
+
 # =============================================================================
 # TTL & CODE METADATA FUNCTIONS - Phase 2
 # =============================================================================
@@ -123,12 +293,13 @@ async def add_episode_with_ttl(
         
         # Set TTL for created entities
         if hasattr(episode, 'created_entities') and episode.created_entities:
-            expires_at = reference_time + timedelta(hours=48)
-            
-            for entity in episode.created_entities:
-                entity_uuid = getattr(entity, 'uuid', None)
-                if entity_uuid:
-                    await _set_entity_ttl(graphiti, entity_uuid, expires_at, group_id)
+            expires_at = reference_time + MEMORY_TTL
+            entity_uuids = [
+                entity.uuid for entity in episode.created_entities
+                if getattr(entity, 'uuid', None)
+            ]
+            # Một round-trip UNWIND cho tất cả entity thay vì mỗi entity một query
+            await _set_entities_ttl(graphiti, entity_uuids, expires_at, group_id)
         
         logger.info(f"Added episode with TTL for group {group_id}")
         return episode
@@ -141,7 +312,8 @@ async def _set_entity_ttl(
     graphiti: Graphiti,
     entity_uuid: str,
     expires_at: datetime,
-    project_id: str
+    project_id: str,
+    session=None
 ):
     """
     Set TTL and project_id for an entity
@@ -151,28 +323,58 @@ async def _set_entity_ttl(
         entity_uuid: Entity UUID
         expires_at: Expiration datetime
         project_id: Project ID for isolation
+        session: Optional open Neo4j session to reuse
     """
-    query = """
-    MATCH (e:Entity {uuid: $uuid})
-    SET e.expires_at = datetime($expires_at),
-        e.project_id = $project_id
-    """
-    
     params = {
         "uuid": entity_uuid,
-        "expires_at": expires_at.isoformat(),
+        "expires_at": _expires_at_value(expires_at),
         "project_id": project_id
     }
     
-    async with graphiti.driver.session() as session:
-        result = await session.run(query, params)
+    async with _session_scope(graphiti, session) as session:
+        result = await session.run(_SET_ENTITY_TTL_QUERY, params)
         # Consume the result to avoid leaving it in the session
         await result.consume()
 
+async def _set_entities_ttl(
+    graphiti: Graphiti,
+    entity_uuids: List[str],
+    expires_at: datetime,
+    project_id: str,
+    session=None
+):
+    """
+    Set TTL and project_id for many entities in one round trip (UNWIND)
+
+    Args:
+        graphiti: Graphiti instance
+        entity_uuids: Entity UUIDs
+        expires_at: Expiration datetime
+        project_id: Project ID for isolation
+        session: Optional open Neo4j session to reuse
+    """
+    if not entity_uuids:
+        return
+
+    params = {
+        "uuids": list(entity_uuids),
+        "expires_at": _expires_at_value(expires_at),
+        "project_id": project_id
+    }
+
+    async with _session_scope(graphiti, session) as session:
+        result = await session.run(_SET_ENTITIES_TTL_QUERY, params)
+        await result.consume()
+
 async def add_code_metadata(
     graphiti: Graphiti,
     entity_uuid: str,
-    metadata: Dict[str, Any]
+    metadata: Dict[str, Any],
+    session=None,
+    return_entity: bool = True,
+    ttl_uuids: Optional[List[str]] = None,
+    expires_at: Optional[datetime] = None,
+    project_id: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Add code-specific metadata to an entity
@@ -197,15 +399,18 @@ async def add_code_metadata(
             - diff_summary: str
             - git_commit: str
             - language: str
+        session: Optional open Neo4j session to reuse
+        return_entity: If False, skip fetching the entity back and
+            return only the properties that were written
+        ttl_uuids: Optional entity UUIDs whose TTL/project_id should be set
+            in the same query (saves a separate _set_entities_ttl round trip)
+        expires_at: Expiration datetime, required with ttl_uuids
+        project_id: Project ID, required with ttl_uuids
     
     Returns:
         Updated entity properties
     """
     try:
-        # Build SET clause dynamically based on provided metadata
-        set_clauses = []
-        params = {"uuid": entity_uuid}
-        
         # Map metadata keys to Neo4j properties
         field_mapping = {
             "file_path": "file_path",
@@ -226,34 +431,54 @@ async def add_code_metadata(
             "language": "language"
         }
         
-        for key, prop_name in field_mapping.items():
-            if key in metadata and metadata[key] is not None:
-                set_clauses.append(f"e.{prop_name} = ${key}")
-                params[key] = metadata[key]
+        # Gửi toàn bộ field qua một map $props (SET e += $props): text query không đổi
+        # theo tập field được truyền nên Neo4j dùng lại cùng một query plan
+        props = {
+            prop_name: metadata[key]
+            for key, prop_name in field_mapping.items()
+            if metadata.get(key) is not None
+        }
         
-        if not set_clauses:
+        if not props:
             logger.warning(f"No metadata provided for entity {entity_uuid}")
+            if ttl_uuids:
+                await _set_entities_ttl(graphiti, ttl_uuids, expires_at, project_id, session=session)
             return {}
         
-        query = f"""
+        params = {"uuid": entity_uuid, "props": props}
+        
+        ttl_clause = ""
+        if ttl_uuids:
+            ttl_clause = _TTL_CLAUSE
+            params["ttl_uuids"] = list(ttl_uuids)
+            params["expires_at"] = _expires_at_value(expires_at)
+            params["project_id"] = project_id
+        
+        query = f"""{ttl_clause}
         MATCH (e:Entity {{uuid: $uuid}})
-        SET {', '.join(set_clauses)}
-        RETURN e
+        SET e += $props
+        {_RETURN_ENTITY_CLAUSE if return_entity else _RETURN_MATCHED_CLAUSE}
         """
         
-        async with graphiti.driver.session() as session:
+        async with _session_scope(graphiti, session) as session:
             result = await session.run(query, params)
+            
+            if not return_entity:
+                # Không cần đọc lại entity: chỉ đếm số entity khớp. Không dựa vào
+                # counters.properties_set vì các SET của TTL clause cũng được tính vào đó
+                record = await result.single()
+                if not record or not record["matched"]:
+                    logger.warning(f"Entity {entity_uuid} not found")
+                    return {}
+                logger.info(f"Added code metadata to entity {entity_uuid}")
+                return props
+            
             record = await result.single()
             
             if record:
                 logger.info(f"Added code metadata to entity {entity_uuid}")
-                # Convert Neo4j types to JSON-serializable types
-                entity_dict = dict(record['e'])
-                # Convert DateTime objects to ISO strings
-                for key, value in entity_dict.items():
-                    if hasattr(value, 'isoformat'):  # DateTime object
-                        entity_dict[key] = value.isoformat()
-                return entity_dict
+                # DateTime đã được toString() trong Cypher nên không cần chuyển đổi thêm
+                return dict(record['e'])
             else:
                 logger.warning(f"Entity {entity_uuid} not found")
                 return {}
@@ -262,27 +487,24 @@ async def add_code_metadata(
         logger.error(f"Error adding code metadata: {e}")
         raise
 
-async def cleanup_expired_memories(graphiti: Graphiti) -> int:
+async def cleanup_expired_memories(graphiti: Graphiti, batch_size: int = 1000) -> int:
     """
     Delete memories that have expired (past TTL of 48 hours)
     
+    Deletes in batches (CALL { ... } IN TRANSACTIONS) so a large sweep
+    does not run as one huge transaction that holds locks on the store.
+    
     Args:
         graphiti: Graphiti instance
+        batch_size: Number of entities deleted per inner transaction
     
     Returns:
         Number of deleted entities
     """
     try:
-        query = """
-        MATCH (e:Entity)
-        WHERE e.expires_at IS NOT NULL 
-          AND datetime(e.expires_at) < datetime()
-        DETACH DELETE e
-        RETURN count(e) as deleted_count
-        """
-        
-        async with graphiti.driver.session() as session:
-            result = await session.run(query)
+        # CALL { } IN TRANSACTIONS chỉ chạy được trong auto-commit transaction (session.run)
+        async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+            result = await session.run(_CLEANUP_EXPIRED_QUERY, {"batch_size": batch_size})
             record = await result.single()
             
             if record:
@@ -295,34 +517,85 @@ async def cleanup_expired_memories(graphiti: Graphiti) -> int:
         logger.error(f"Error during cleanup: {e}")
         raise
 
+async def normalize_expires_at(graphiti: Graphiti) -> int:
+    """
+    Convert expires_at values stored as Neo4j DateTime (older ingests) to ISO strings
+
+    Idempotent: entities that already store a string are not rewritten.
+
+    Args:
+        graphiti: Graphiti instance
+
+    Returns:
+        Number of converted entities
+    """
+    async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+        result = await session.run(_NORMALIZE_EXPIRES_AT_QUERY)
+        record = await result.single()
+
+    converted_count = record["converted_count"] if record else 0
+    if converted_count:
+        logger.info(f"Converted expires_at of {converted_count} entities to ISO strings")
+    return converted_count
+
 async def create_indexes(graphiti: Graphiti):
     """
     Create Neo4j indexes for performance optimization
     
     Indexes created:
-    - project_id: For strict project isolation queries
-    - expires_at: For TTL cleanup queries
+    - project_id: For strict project isolation queries (e.g. project stats)
+    - (project_id, expires_at): Composite index for active-memory filtering
+      (/search/code filters on project_id AND expires_at)
+    - expires_at: For TTL cleanup queries (not filtered by project)
     - file_path: For file-based filtering
     - change_type: For change type filtering
+    - (group_id, created_at): Composite index for group lookups ordered by time
+    
+    A composite range index only holds nodes that have every indexed property,
+    so it cannot serve queries that filter on project_id alone; the single-column
+    project_id index is kept for those.
     """
     indexes = [
-        ("entity_project_id", "Entity", "project_id"),
-        ("entity_expires_at", "Entity", "expires_at"),
-        ("entity_file_path", "Entity", "file_path"),
-        ("entity_change_type", "Entity", "change_type"),
+        ("entity_project_id", "Entity", ("project_id",)),
+        ("entity_project_id_expires_at", "Entity", ("project_id", "expires_at")),
+        ("entity_expires_at", "Entity", ("expires_at",)),
+        ("entity_file_path", "Entity", ("file_path",)),
+        ("entity_change_type", "Entity", ("change_type",)),
+        ("entity_group_id_created_at", "Entity", ("group_id", "created_at")),
     ]
     
-    async with graphiti.driver.session() as session:
-        for index_name, label, property_name in indexes:
+    # Dựng toàn bộ câu lệnh schema một lần
+    statements = [
+        (
+            f"Created index: {index_name}",
+            f"CREATE INDEX {index_name} IF NOT EXISTS FOR (n:{label}) "
+            f"ON ({', '.join(f'n.{prop}' for prop in properties)})",
+        )
+        for index_name, label, properties in indexes
+    ]
+    
+    async def _apply_schema(tx):
+        for _, query in statements:
+            result = await tx.run(query)
+            await result.consume()
+    
+    async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+        # Chạy tất cả trong một transaction (lấy schema lock một lần)
+        try:
+            await session.execute_write(_apply_schema)
+            for message, _ in statements:
+                logger.info(message)
+            return
+        except Exception as e:
+            logger.warning(f"Batched index creation failed, retrying one by one: {e}")
+        
+        # Fallback: từng câu lệnh riêng để một lỗi không chặn các index còn lại
+        for message, query in statements:
             try:
-                query = f"""
-                CREATE INDEX {index_name} IF NOT EXISTS
-                FOR (n:{label}) ON (n.{property_name})
-                """
                 await session.run(query)
-                logger.info(f"Created index: {index_name}")
+                logger.info(message)
             except Exception as e:
-                logger.warning(f"Index {index_name} may already exist: {e}")
+                logger.warning(f"Schema statement failed ({query}): {e}")
 
 async def get_project_stats(graphiti: Graphiti, project_id: str) -> Dict[str, Any]:
     """
@@ -340,41 +613,33 @@ async def get_project_stats(graphiti: Graphiti, project_id: str) -> Dict[str, An
         - expired_count: Number of expired memories
     """
     try:
-        query = """
-        MATCH (e:Entity {project_id: $project_id})
-        WITH e,
-             CASE 
-                WHEN e.expires_at IS NOT NULL AND datetime(e.expires_at) > datetime() 
-                THEN 'active' 
-                ELSE 'expired' 
-             END as status
-        RETURN 
-            count(CASE WHEN status = 'active' THEN 1 END) as active_count,
-            count(CASE WHEN status = 'expired' THEN 1 END) as expired_count,
-            count(DISTINCT e.file_path) as files_count,
-            collect(DISTINCT e.change_type) as change_types
-        """
+        # execute_query tự quản lý session/transaction (có retry lỗi transient) và đọc hết kết quả.
+        # Tham số truyền dạng keyword để dùng được cho cả AsyncDriver lẫn Neo4jDriver của Graphiti.
+        records, _, _ = await graphiti.driver.execute_query(
+            _PROJECT_STATS_QUERY,
+            project_id=project_id,
+            database_=NEO4J_DATABASE,
+            routing_=RoutingControl.READ,
+        )
         
-        async with graphiti.driver.session() as session:
-            result = await session.run(query, {"project_id": project_id})
-            record = await result.single()
-            
-            if record:
-                return {
-                    "project_id": project_id,
-                    "total_memories": record["active_count"],
-                    "expired_memories": record["expired_count"],
-                    "files_count": record["files_count"],
-                    "change_types": [ct for ct in record["change_types"] if ct is not None]
-                }
+        if records:
+            record = records[0]
             return {
                 "project_id": project_id,
-                "total_memories": 0,
-                "expired_memories": 0,
-                "files_count": 0,
-                "change_types": []
+                "total_memories": record["active_count"],
+                "expired_memories": record["expired_count"],
+                "files_count": record["files_count"],
+                # collect() đã bỏ qua null nên không cần lọc lại
+                "change_types": record["change_types"]
             }
-            
+        return {
+            "project_id": project_id,
+            "total_memories": 0,
+            "expired_memories": 0,
+            "files_count": 0,
+            "change_types": []
+        }
+        
     except Exception as e:
         logger.error(f"Error getting project stats: {e}")
         raise
@@ -22,9 +22,10 @@ load_dotenv()
 # Prompts
 # =============================================================================
 
-CONVERSATION_PROMPT = """Classify this fact's importance category and score.
-
-**Fact:** "{fact}"
+# Constant instructions go in the system message so the prompt prefix is
+# identical across calls (eligible for OpenAI prompt caching); only the short
+# user message below is formatted per request.
+CONVERSATION_SYSTEM_PROMPT = """Classify a fact's importance category and score.
 
 **Categories (score):**
 - identity (1.0): Personal information like name, age, location, occupation
@@ -52,18 +53,14 @@ Fact: "User completed snake game project with AI opponent"
 Fact: "User said hello"
 → greeting|0.1
 
-**Output format:** category|score
+**Output format:** category|score"""
 
-**Your classification:**"""
+CONVERSATION_PROMPT = """**Fact:** "{fact}"
 
+**Your classification:**"""
 
-CODE_PROMPT = """Score this code change's importance.
 
-**Code Change:**
-- Type: {change_type}
-- File: {file_path}
-- Severity: {severity}
-- Summary: {summary}
+CODE_SYSTEM_PROMPT = """Score a code change's importance.
 
 **Categories (score):**
 - critical_bug (1.0): Security vulnerabilities, data loss risks, system crashes
@@ -98,7 +95,13 @@ Change: refactored, utils/helper.py, low, "Code formatting"
 Change: fixed, api/middleware.py, medium, "Timeout error in requests"
 → bug_fix|0.75
 
-**Output format:** category|score
+**Output format:** category|score"""
+
+CODE_PROMPT = """**Code Change:**
+- Type: {change_type}
+- File: {file_path}
+- Severity: {severity}
+- Summary: {summary}
 
 **Your classification:**"""
 
@@ -186,7 +189,10 @@ class LLMImportanceScorer:
         
         response = self.client.chat.completions.create(
             model=self.model,
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": CONVERSATION_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
             temperature=0.2,
             max_tokens=50,
         )
@@ -242,7 +248,10 @@ class LLMImportanceScorer:
         
         response = self.client.chat.completions.create(
             model=self.model,
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": CODE_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
             temperature=0.2,
             max_tokens=50,
         )
@@ -1,29 +1,181 @@
 # app/main.py
 import asyncio
+import json
+import logging
 import os
-from datetime import datetime
-from fastapi import FastAPI, Depends, BackgroundTasks, HTTPException
-from fastapi.responses import Response
-from graphiti_core import Graphiti
+import traceback
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Depends, HTTPException
+from fastapi.responses import Response, JSONResponse
 from graphiti_core.nodes import EpisodeType
-from app.graph import get_graphiti
-from app.graph import _graphiti  # for reset endpoint
+from app.graph import (
+    get_graphiti, reset_graphiti_cache, add_code_metadata,
+    _set_entities_ttl, _created_entity_uuids, cleanup_expired_memories, get_project_stats,
+    create_indexes, normalize_expires_at, MEMORY_TTL, NEO4J_DATABASE, _to_utc
+)
 from app.schemas import (
     IngestText, IngestMessage, IngestJSON, SearchRequest,
     IngestCodeChange, IngestCodeContext, SearchCodeRequest
 )
 from app.cache import (
-    cached_with_ttl, cache_search_result, memory_cache, 
-    invalidate_search_cache, invalidate_node_cache, get_cache_metrics
+    cache_search_result, cache_project_stats, memory_cache, 
+    invalidate_search_cache, invalidate_stats_cache, invalidate_node_cache, invalidate_all_cache,
+    get_cache_metrics
 )
-app = FastAPI(title="Graphiti Memory Layer")
+from app.prompts import format_query_translation_prompt, PROMPT_CONFIG
+from app.importance import get_scorer
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# Cypher queries (hằng số module: không dựng lại chuỗi mỗi request, Neo4j dùng lại query plan)
+# =============================================================================
+
+_GROUP_ID_LOOKUP_QUERY = """
+    MATCH (n)
+    WHERE n.uuid IN $uuids
+    RETURN n.uuid as uuid, n.group_id as group_id
+"""
+
+# `e.created_at IS NOT NULL` không đổi kết quả (Graphiti luôn set created_at) nhưng cho phép
+# planner dùng index composite entity_group_id_created_at cho cả WHERE lẫn ORDER BY
+_EXPORT_ENTITIES_QUERY = """
+    MATCH (e:Entity)
+    WHERE e.group_id = $group_id
+      AND e.created_at IS NOT NULL
+    RETURN e.uuid AS uuid,
+           e.name AS name,
+           e.summary AS summary,
+           e.created_at AS created_at
+    ORDER BY e.created_at ASC
+"""
+
+_DEBUG_ALL_ENTITIES_QUERY = """
+    MATCH (e:Entity)
+    RETURN e.uuid as uuid, 
+           e.name as name, 
+           e.project_id as project_id,
+           e.group_id as group_id,
+           e.expires_at as expires_at,
+           e.created_at as created_at
+    ORDER BY e.created_at DESC
+    LIMIT $limit
+"""
+
+_DEBUG_GROUP_ENTITIES_QUERY = """
+    MATCH (e:Entity)
+    WHERE e.group_id = $group_id
+      AND e.created_at IS NOT NULL
+    RETURN e.uuid as uuid, e.name as name, e.group_id as group_id, 
+           e.summary as summary, e.created_at as created_at
+    ORDER BY e.created_at DESC
+    LIMIT 50
+"""
+
+_DEBUG_GROUP_RELATIONSHIPS_QUERY = """
+    MATCH (e1:Entity)-[r]-(e2:Entity)
+    WHERE e1.group_id = $group_id
+    RETURN e1.name as source, type(r) as relationship, 
+           properties(r) as properties, e2.name as target,
+           e1.uuid as source_uuid, e2.uuid as target_uuid
+    LIMIT 50
+"""
+
+_EPISODE_MENTIONS_QUERY = """
+    MATCH (ep:Episodic {uuid: $episode_uuid})-[:MENTIONS]->(e:Entity)
+    WHERE e.created_at >= $since
+    RETURN e.uuid as uuid
+    LIMIT 10
+"""
+
+_RECENT_GROUP_ENTITIES_QUERY = """
+    MATCH (e:Entity {group_id: $group_id})
+    WHERE e.created_at >= $since
+    RETURN e.uuid as uuid
+    ORDER BY e.created_at DESC
+    LIMIT 10
+"""
+
+_CODE_FILTER_QUERY = """
+    MATCH (e:Entity)
+    WHERE e.project_id = $project_id
+      AND e.expires_at IS NOT NULL
+      AND datetime(e.expires_at) > datetime()
+      AND ($cutoff IS NULL OR e.created_at >= $cutoff)
+      AND ($file_path IS NULL OR e.file_path = $file_path)
+      AND ($function_name IS NULL OR e.function_name = $function_name)
+      AND ($change_type IS NULL OR e.change_type = $change_type)
+    RETURN e.uuid as uuid,
+           e.summary as summary,
+           e.file_path as file_path,
+           e.function_name as function_name,
+           e.change_type as change_type,
+           e.change_summary as change_summary,
+           e.severity as severity,
+           e.code_after_id as code_after_id,
+           e.code_after_hash as code_after_hash,
+           e.diff_summary as diff_summary,
+           e.created_at as created_at
+"""
+
+# Chu kỳ tự động dọn memories hết hạn (giây). Mặc định 0 = tắt: việc dọn dẹp
+# DETACH DELETE dữ liệu nên phải được bật tường minh
+CLEANUP_INTERVAL_SECONDS = int(os.getenv("CLEANUP_INTERVAL_SECONDS", "0"))
+
+async def _periodic_cleanup():
+    """Định kỳ xóa các memories đã hết TTL"""
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+        try:
+            deleted_count = await cleanup_expired_memories(await get_graphiti())
+            if deleted_count:
+                invalidate_stats_cache()
+        except Exception as e:
+            logger.warning(f"Periodic cleanup failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Khởi động/tắt app (thay cho các hook on_event đã deprecated)"""
+    # Tạo các index cần thiết (idempotent nhờ IF NOT EXISTS)
+    try:
+        await create_indexes(await get_graphiti())
+    except Exception as e:
+        logger.warning(f"Could not create Neo4j indexes on startup: {e}")
+
+    # Đổi expires_at kiểu DateTime (dữ liệu cũ) sang chuỗi ISO mà graphiti serialize được
+    try:
+        await normalize_expires_at(await get_graphiti())
+    except Exception as e:
+        logger.warning(f"Could not normalize expires_at on startup: {e}")
+
+    cleanup_task = None
+    if CLEANUP_INTERVAL_SECONDS > 0:
+        logger.warning(
+            f"Periodic cleanup ENABLED: every {CLEANUP_INTERVAL_SECONDS}s, deleting entities "
+            f"past expires_at (code memories TTL = {MEMORY_TTL})"
+        )
+        cleanup_task = asyncio.create_task(_periodic_cleanup())
+    else:
+        logger.info("Periodic cleanup disabled (set CLEANUP_INTERVAL_SECONDS > 0 to enable)")
+    app.state.cleanup_task = cleanup_task
+
+    try:
+        yield
+    finally:
+        # Dừng task dọn dẹp khi tắt app, chờ nó kết thúc hẳn
+        if cleanup_task is not None:
+            cleanup_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await cleanup_task
+
+app = FastAPI(title="Graphiti Memory Layer", lifespan=lifespan)
 
 @app.post("/ingest/text")
 async def ingest_text(payload: IngestText, graphiti=Depends(get_graphiti)):
     ts = datetime.fromisoformat(payload.reference_time) if payload.reference_time else datetime.utcnow()
     # Debug logging
-    import logging
-    logger = logging.getLogger(__name__)
     logger.info(f"Ingesting text with group_id: {payload.group_id}")
     
     ep = await graphiti.add_episode(
@@ -50,8 +202,6 @@ async def ingest_message(payload: IngestMessage, graphiti=Depends(get_graphiti))
     body = "\n".join(payload.messages)  # yêu cầu dạng "speaker: message" theo doc
     
     # Debug logging
-    import logging
-    logger = logging.getLogger(__name__)
     logger.info(f"Ingesting message with group_id: {payload.group_id}, name: {payload.name}")
     
     ep = await graphiti.add_episode(
@@ -76,17 +226,12 @@ async def ingest_message(payload: IngestMessage, graphiti=Depends(get_graphiti))
 
 @app.post("/search")
 async def search(req: SearchRequest, graphiti=Depends(get_graphiti)):
-    import logging
-    from openai import OpenAI
-    from app.prompts import format_query_translation_prompt, PROMPT_CONFIG
-    
-    logger = logging.getLogger(__name__)
     
     # Kiểm tra cache trước
     cache_key = cache_search_result(req.query, req.focal_node_uuid, req.group_id)
-    cached_result = memory_cache.get(cache_key)
-    if cached_result is not None:
-        return cached_result
+    cached_body = memory_cache.get(cache_key)
+    if cached_body is not None:
+        return Response(content=cached_body, media_type="application/json")
 
     # Auto-translate non-English queries to English for better semantic search
     search_query = req.query
@@ -119,9 +264,6 @@ async def search(req: SearchRequest, graphiti=Depends(get_graphiti)):
 
     # Chuẩn hoá đầu ra (ví dụ edges → fact/plaintext)
     def normalize(item):
-        import logging
-        logger = logging.getLogger(__name__)
-        
         # item có thể là edge/node hoặc dict; ưu tiên các trường id phổ biến
         if isinstance(item, dict):
             txt = item.get("fact") or item.get("text") or item.get("name") or str(item)
@@ -146,13 +288,21 @@ async def search(req: SearchRequest, graphiti=Depends(get_graphiti)):
             )
             grp_id = getattr(item, "group_id", None) or getattr(item, "groupId", None)
         
-        # Debug logging
-        logger.info(f"Normalize: type={type(item).__name__}, text={txt[:50] if txt else 'N/A'}, id={ident}, group_id={grp_id}")
+        # Debug logging (chỉ format khi DEBUG bật - hàm này chạy cho mọi kết quả search)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Normalize: type=%s, text=%s, id=%s, group_id=%s",
+                type(item).__name__, txt[:50] if txt else 'N/A', ident, grp_id
+            )
         
         if not grp_id:
-            logger.warning(f"Search result missing group_id: {type(item)} - {txt[:50] if txt else 'N/A'}")
+            logger.warning("Search result missing group_id: %s - %s", type(item), txt[:50] if txt else 'N/A')
         if not ident:
-            logger.warning(f"Search result missing ID: {type(item)} - {txt[:50] if txt else 'N/A'}, item_keys={list(item.keys()) if isinstance(item, dict) else dir(item)}")
+            logger.warning(
+                "Search result missing ID: %s - %s, item_keys=%s",
+                type(item), txt[:50] if txt else 'N/A',
+                list(item.keys()) if isinstance(item, dict) else dir(item)
+            )
         
         return {"text": txt, "id": ident, "group_id": grp_id}
 
@@ -165,24 +315,15 @@ async def search(req: SearchRequest, graphiti=Depends(get_graphiti)):
         
         if missing_group_ids:
             # Fetch group_ids from Neo4j for items missing them
-            import logging
-            logger = logging.getLogger(__name__)
             logger.info(f"Fetching group_ids from Neo4j for {len(missing_group_ids)} items")
             
             # Create a map of uuid -> group_id from Neo4j
             uuids = [item["id"] for item in missing_group_ids if item.get("id")]
             if uuids:
-                query = """
-                MATCH (n)
-                WHERE n.uuid IN $uuids
-                RETURN n.uuid as uuid, n.group_id as group_id
-                """
-                group_id_map = {}
-                async with graphiti.driver.session() as session:
-                    result = await session.run(query, {"uuids": uuids})
-                    async for record in result:
-                        if record["group_id"]:
-                            group_id_map[record["uuid"]] = record["group_id"]
+                async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+                    result = await session.run(_GROUP_ID_LOOKUP_QUERY, {"uuids": uuids})
+                    rows = await result.data()
+                group_id_map = {row["uuid"]: row["group_id"] for row in rows if row["group_id"]}
                 
                 # Update normalized items with fetched group_ids
                 for item in normalized:
@@ -206,11 +347,11 @@ async def search(req: SearchRequest, graphiti=Depends(get_graphiti)):
     q_variants = {q, f"user: {q}", f"assistant: {q}"}
     filtered = [it for it in deduped if (it.get("text") or "").strip() not in q_variants]
 
-    # Cache kết quả với TTL 30 phút
-    result = {"results": filtered}
-    memory_cache.set(cache_key, result, ttl=1800)
+    # Serialize một lần rồi cache bytes (TTL 30 phút) - cache hit trả thẳng bytes, không encode lại
+    body = JSONResponse(content={"results": filtered}).body
+    memory_cache.set(cache_key, body, ttl=1800)
     
-    return result
+    return Response(content=body, media_type="application/json")
 @app.get("/")
 def root():
     return {
@@ -231,32 +372,15 @@ def root():
 @app.get("/export/{group_id}")
 async def export_conversation(group_id: str, graphiti=Depends(get_graphiti)):
     """Export conversation to JSON for backup/sharing"""
-    import logging
-    logger = logging.getLogger(__name__)
-    
     try:
         # Query all entities for this group
-        query_entities = """
-        MATCH (e:Entity)
-        WHERE e.group_id = $group_id
-        RETURN e.uuid AS uuid,
-               e.name AS name,
-               e.summary AS summary,
-               e.created_at AS created_at
-        ORDER BY e.created_at ASC
-        """
-        
-        entities = []
-        
-        async with graphiti.driver.session() as session:
-            result = await session.run(query_entities, {"group_id": group_id})
-            async for record in result:
-                entities.append({
-                    "uuid": record["uuid"],
-                    "name": record["name"],
-                    "summary": record["summary"],
-                    "created_at": str(record["created_at"]) if record["created_at"] else None,
-                })
+        async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+            result = await session.run(_EXPORT_ENTITIES_QUERY, {"group_id": group_id})
+            entities = await result.data()
+        
+        for entity in entities:
+            if entity["created_at"]:
+                entity["created_at"] = str(entity["created_at"])
         
         export_data = {
             "group_id": group_id,
@@ -268,9 +392,9 @@ async def export_conversation(group_id: str, graphiti=Depends(get_graphiti)):
         
         logger.info(f"Exported {group_id}: {len(entities)} entities")
         
-        # Return with proper UTF-8 encoding (no Unicode escaping)
-        import json
-        json_str = json.dumps(export_data, ensure_ascii=False, indent=2)
+        # Return with proper UTF-8 encoding (no Unicode escaping), compact -
+        # UI tự format lại (indent) khi tạo file download
+        json_str = json.dumps(export_data, ensure_ascii=False, separators=(",", ":"))
         
         # Encode to UTF-8 bytes to preserve Vietnamese characters
         return Response(
@@ -321,7 +445,6 @@ async def get_cache_stats():
 @app.post("/cache/clear")
 async def clear_cache():
     """Xóa toàn bộ cache"""
-    from app.cache import invalidate_all_cache
     invalidate_all_cache()
     return {"message": "Cache cleared successfully"}
 
@@ -349,7 +472,6 @@ async def cache_health():
 @app.post("/config/reload-neo4j")
 async def reload_neo4j_config():
     # Đặt lại singleton để lần gọi tiếp theo tạo kết nối mới theo .env
-    from app.graph import reset_graphiti_cache
     reset_graphiti_cache()
     return {"message": "Neo4j config reloaded. Restart next request will create a new connection."}
 
@@ -357,30 +479,14 @@ async def reload_neo4j_config():
 async def debug_all_entities(limit: int = 50, graphiti=Depends(get_graphiti)):
     """Debug: Show ALL entities regardless of project_id"""
     try:
-        query = """
-        MATCH (e:Entity)
-        RETURN e.uuid as uuid, 
-               e.name as name, 
-               e.project_id as project_id,
-               e.group_id as group_id,
-               e.expires_at as expires_at,
-               e.created_at as created_at
-        ORDER BY e.created_at DESC
-        LIMIT $limit
-        """
-        
-        entities = []
-        async with graphiti.driver.session() as session:
-            result = await session.run(query, {"limit": limit})
-            async for record in result:
-                entities.append({
-                    "uuid": record["uuid"],
-                    "name": record["name"],
-                    "project_id": record["project_id"],
-                    "group_id": record["group_id"],
-                    "expires_at": str(record["expires_at"]) if record["expires_at"] else None,
-                    "created_at": str(record["created_at"]) if record["created_at"] else None
-                })
+        async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+            result = await session.run(_DEBUG_ALL_ENTITIES_QUERY, {"limit": limit})
+            entities = await result.data()
+        
+        for entity in entities:
+            for key in ("expires_at", "created_at"):
+                if entity[key]:
+                    entity[key] = str(entity[key])
         
         return {
             "total": len(entities),
@@ -394,18 +500,9 @@ async def debug_episodes_by_group(group_id: str, graphiti=Depends(get_graphiti))
     """Debug endpoint to check entities in Neo4j by group_id (group_id is stored in Entity nodes, not EpisodeNode)"""
     try:
         # Query Neo4j directly for Entity nodes with this group_id
-        query = """
-        MATCH (e:Entity)
-        WHERE e.group_id = $group_id
-        RETURN e.uuid as uuid, e.name as name, e.group_id as group_id, 
-               e.summary as summary, e.created_at as created_at
-        ORDER BY e.created_at DESC
-        LIMIT 50
-        """
-        
         records = []
-        async with graphiti.driver.session() as session:
-            result = await session.run(query, {"group_id": group_id})
+        async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+            result = await session.run(_DEBUG_GROUP_ENTITIES_QUERY, {"group_id": group_id})
             async for record in result:
                 records.append({
                     "uuid": record["uuid"],
@@ -415,27 +512,9 @@ async def debug_episodes_by_group(group_id: str, graphiti=Depends(get_graphiti))
                     "created_at": str(record["created_at"]).split("T")[0]
                 })
         # Query Neo4j for relationships between entities with this group_id
-        query = """
-        MATCH (e1:Entity)-[r]-(e2:Entity)
-        WHERE e1.group_id = $group_id
-        RETURN e1.name as source, type(r) as rel_type, 
-               properties(r) as rel_props, e2.name as target,
-               e1.uuid as source_uuid, e2.uuid as target_uuid
-        LIMIT 50
-        """
-        
-        records = []
-        async with graphiti.driver.session() as session:
-            result = await session.run(query, {"group_id": group_id})
-            async for record in result:
-                records.append({
-                    "source": record["source"],
-                    "relationship": record["rel_type"],
-                    "properties": record["rel_props"],
-                    "target": record["target"],
-                    "source_uuid": record["source_uuid"],
-                    "target_uuid": record["target_uuid"]
-                })
+        async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+            result = await session.run(_DEBUG_GROUP_RELATIONSHIPS_QUERY, {"group_id": group_id})
+            records = await result.data()
         
         return {
             "group_id": group_id,
@@ -462,11 +541,6 @@ async def ingest_code_change(payload: IngestCodeChange, graphiti=Depends(get_gra
             "category": "bug_fix"
         }
     """
-    import logging
-    from graphiti_core.nodes import EpisodeType
-    from app.importance import get_scorer
-    
-    logger = logging.getLogger(__name__)
     
     try:
         # Score importance with LLM
@@ -500,7 +574,6 @@ async def ingest_code_change(payload: IngestCodeChange, graphiti=Depends(get_gra
         logger.info(f"Episode created: {episode_uuid}")
         
         # Invalidate search cache (sync function)
-        from app.cache import invalidate_search_cache
         invalidate_search_cache()
         
         return {
@@ -527,19 +600,6 @@ async def ingest_code_context(payload: IngestCodeContext, graphiti=Depends(get_g
     
     Stores metadata about code changes with 48-hour TTL.
     """
-    import logging
-    import json
-    from app.graph import add_episode_with_ttl, add_code_metadata
-    
-    logger = logging.getLogger(__name__)
-    
-    # DEBUG: Check if payload contains DateTime objects
-    try:
-        _ = json.dumps(payload.dict())
-        logger.info("✓ Payload serialization OK")
-    except TypeError as te:
-        logger.error(f"✗ Payload has DateTime: {te}")
-        raise HTTPException(status_code=400, detail=f"Invalid datetime in payload: {str(te)}")
     
     try:
         logger.info("=== START INGEST ===")
@@ -548,6 +608,9 @@ async def ingest_code_context(payload: IngestCodeContext, graphiti=Depends(get_g
         ts = datetime.fromisoformat(payload.reference_time) if payload.reference_time else datetime.utcnow()
         logger.info(f"Parsed reference_time: {type(ts)} = {ts}")
         
+        # Tính thời điểm hết hạn một lần cho cả TTL lẫn response
+        expires_at_dt = ts + MEMORY_TTL
+        
         # Validate project_id
         if not payload.project_id:
             raise HTTPException(status_code=400, detail="project_id is required")
@@ -558,9 +621,10 @@ async def ingest_code_context(payload: IngestCodeContext, graphiti=Depends(get_g
         
         logger.info(f"Ingesting code context for project {payload.project_id}: {payload.name}")
         
-        # Add episode using Graphiti directly (not via add_episode_with_ttl)
-        from graphiti_core.nodes import EpisodeType
+        # Mốc để phân biệt entity do episode này tạo với entity đã có từ trước
+        ingest_started = datetime.now(timezone.utc)
         
+        # Add episode using Graphiti directly (not via add_episode_with_ttl)
         episode = await graphiti.add_episode(
             name=payload.name,
             episode_body=payload.summary,
@@ -570,118 +634,80 @@ async def ingest_code_context(payload: IngestCodeContext, graphiti=Depends(get_g
             group_id=payload.project_id
         )
         
-        logger.info(f"Episode created, waiting for entities to be created...")
-        
-        # Wait for Graphiti to process and create entities
-        import asyncio
-        await asyncio.sleep(2)  # Give Graphiti time to create entities
-        
-        # Query Neo4j to find entities created for this group
-        query = """
-        MATCH (e:Entity {group_id: $group_id})
-        WHERE e.created_at >= datetime($reference_time)
-        RETURN e.uuid as uuid
-        ORDER BY e.created_at DESC
-        LIMIT 10
-        """
-        
-        entity_uuids = []
-        async with graphiti.driver.session() as session:
-            result = await session.run(query, {
-                "group_id": payload.project_id,
-                "reference_time": (ts - __import__('datetime').timedelta(seconds=10)).isoformat()
-            })
-            async for record in result:
-                entity_uuids.append(record["uuid"])
+        # add_episode chỉ trả về sau khi entities đã được ghi vào Neo4j,
+        # nên lấy UUID trực tiếp từ kết quả thay vì sleep rồi query lại.
+        # episode.nodes gồm cả entity cũ được dedupe: chỉ giữ entity mới tạo
+        entity_uuids = _created_entity_uuids(getattr(episode, "nodes", None), ingest_started)
+        logger.info(f"Episode created {len(entity_uuids)} new entities")
+        
+        # Fallback: tìm entities qua cạnh MENTIONS của chính episode này (xác định,
+        # không bị lẫn với ingest đồng thời như cách lấy "entity mới nhất theo thời gian")
+        episode_uuid = getattr(getattr(episode, "episode", None), "uuid", None)
+        
+        # Dùng chung một session cho lookup, TTL và metadata (tránh mở session mới mỗi bước)
+        async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+            if not entity_uuids:
+                if episode_uuid:
+                    result = await session.run(_EPISODE_MENTIONS_QUERY, {
+                        "episode_uuid": episode_uuid,
+                        "since": ingest_started
+                    })
+                else:
+                    result = await session.run(_RECENT_GROUP_ENTITIES_QUERY, {
+                        "group_id": payload.project_id,
+                        "since": ingest_started
+                    })
+                async for record in result:
+                    entity_uuids.append(record["uuid"])
         
-        logger.info(f"Found {len(entity_uuids)} entities for group {payload.project_id}")
+            logger.info(f"Found {len(entity_uuids)} entities for group {payload.project_id}")
         
-        # Use first entity UUID
-        entity_uuid = entity_uuids[0] if entity_uuids else None
+            # Use first entity UUID
+            entity_uuid = entity_uuids[0] if entity_uuids else None
         
-        if not entity_uuid:
-            logger.warning(f"No entity UUID found for group {payload.project_id}")
+            if not entity_uuid:
+                logger.warning(f"No entity UUID found for group {payload.project_id}")
         
-        # Set TTL and project_id for ALL found entities
-        if entity_uuids:
-            from app.graph import _set_entity_ttl
-            from datetime import timedelta as td
-            expires_at_dt = ts + td(hours=48)
-            
-            for uuid in entity_uuids:
-                await _set_entity_ttl(graphiti, uuid, expires_at_dt, payload.project_id)
-                logger.info(f"Set TTL for entity {uuid}")
-        
-        # Add code-specific metadata to first entity
-        if entity_uuid:
-            logger.info("Building metadata dict...")
-            metadata_dict = {}
-            
-            # Extract metadata from payload
-            meta = payload.metadata
-            logger.info(f"Meta timestamp type: {type(meta.timestamp)}")
-            if meta.file_path:
-                metadata_dict["file_path"] = meta.file_path
-            if meta.function_name:
-                metadata_dict["function_name"] = meta.function_name
-            if meta.line_start is not None:
-                metadata_dict["line_start"] = meta.line_start
-            if meta.line_end is not None:
-                metadata_dict["line_end"] = meta.line_end
-            
-            metadata_dict["change_type"] = meta.change_type
-            metadata_dict["change_summary"] = meta.change_summary
-            # Ensure timestamp is string (it should already be from schema, but ensure it)
-            metadata_dict["timestamp"] = str(meta.timestamp) if meta.timestamp else None
-            
-            if meta.severity:
-                metadata_dict["severity"] = meta.severity
-            
-            # Code references
-            if meta.code_before_ref:
-                metadata_dict["code_before_id"] = meta.code_before_ref.code_id
-                metadata_dict["code_before_hash"] = meta.code_before_ref.code_hash
-                metadata_dict["language"] = meta.code_before_ref.language
-            
-            if meta.code_after_ref:
-                metadata_dict["code_after_id"] = meta.code_after_ref.code_id
-                metadata_dict["code_after_hash"] = meta.code_after_ref.code_hash
-                if not metadata_dict.get("language"):
-                    metadata_dict["language"] = meta.code_after_ref.language
-            
-            # Diff info
-            if meta.lines_added is not None:
-                metadata_dict["lines_added"] = meta.lines_added
-            if meta.lines_removed is not None:
-                metadata_dict["lines_removed"] = meta.lines_removed
-            if meta.diff_summary:
-                metadata_dict["diff_summary"] = meta.diff_summary
-            
-            # Git info
-            if meta.git_commit:
-                metadata_dict["git_commit"] = meta.git_commit
+            # Add code-specific metadata to first entity
+            if entity_uuid:
+                logger.info("Building metadata dict...")
+                
+                # Extract metadata from payload (một lần model_dump thay cho từng if/getattr)
+                meta = payload.metadata
+                metadata_dict = meta.model_dump(
+                    exclude_none=True, exclude={"code_before_ref", "code_after_ref"}
+                )
+                
+                # Code references
+                for prefix, ref in (("code_before", meta.code_before_ref), ("code_after", meta.code_after_ref)):
+                    if ref:
+                        metadata_dict[f"{prefix}_id"] = ref.code_id
+                        metadata_dict[f"{prefix}_hash"] = ref.code_hash
+                        metadata_dict.setdefault("language", ref.language)
             
-            # Add to entity
-            try:
-                result = await add_code_metadata(graphiti, entity_uuid, metadata_dict)
-                logger.info(f"Added code metadata to entity {entity_uuid}")
-                # Don't use the result - it might contain DateTime objects
-                del result
-            except Exception as meta_error:
-                logger.error(f"Error adding metadata: {str(meta_error)}")
-                import traceback
-                logger.error(f"Traceback: {traceback.format_exc()}")
-                # Continue anyway - metadata is optional
-        
+                # Add to entity, setting TTL and project_id for ALL found entities in the same query
+                try:
+                    await add_code_metadata(
+                        graphiti, entity_uuid, metadata_dict, session=session, return_entity=False,
+                        ttl_uuids=entity_uuids, expires_at=expires_at_dt, project_id=payload.project_id
+                    )
+                    logger.info(f"Added code metadata to entity {entity_uuid}, set TTL for {len(entity_uuids)} entities")
+                except Exception as meta_error:
+                    logger.error(f"Error adding metadata: {str(meta_error)}")
+                    logger.error(f"Traceback: {traceback.format_exc()}")
+                    # Continue anyway - metadata is optional, but TTL is not
+                    await _set_entities_ttl(
+                        graphiti, entity_uuids, expires_at_dt, payload.project_id, session=session
+                    )
+
         # Invalidate cache
         invalidate_search_cache()
+        invalidate_stats_cache(payload.project_id)
         
         logger.info("Preparing response...")
         
-        # Calculate expiration and convert to string immediately
-        from datetime import timedelta
-        expires_dt = ts + timedelta(hours=48)
-        expires_at_str = expires_dt.isoformat()
+        # Convert expiration to string
+        expires_at_str = expires_at_dt.isoformat()
         if not expires_at_str.endswith('Z'):
             expires_at_str += "Z"
         
@@ -690,10 +716,9 @@ async def ingest_code_context(payload: IngestCodeContext, graphiti=Depends(get_g
         project_id_str = str(payload.project_id)
         name_str = str(payload.name)
         
-        logger.info(f"Returning response...")
+        logger.info("Returning response...")
         
         # Return JSONResponse explicitly to avoid any serialization issues
-        from fastapi.responses import JSONResponse
         return JSONResponse(content={
             "episode_id": episode_id_str,
             "project_id": project_id_str,
@@ -704,7 +729,6 @@ async def ingest_code_context(payload: IngestCodeContext, graphiti=Depends(get_g
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         error_msg = str(e)
         # If error message contains non-serializable objects, just use the exception type
         try:
@@ -725,10 +749,6 @@ async def search_code(req: SearchCodeRequest, graphiti=Depends(get_graphiti)):
     
     Returns only memories from the specified project that haven't expired.
     """
-    import logging
-    from datetime import timedelta
-    
-    logger = logging.getLogger(__name__)
     
     try:
         # Validate project_id (REQUIRED for isolation)
@@ -739,77 +759,41 @@ async def search_code(req: SearchCodeRequest, graphiti=Depends(get_graphiti)):
         
         # Step 1: Semantic search (no project filter yet)
         if req.focal_node_uuid:
-            results = await graphiti.search(req.query, req.focal_node_uuid)
+            search_coro = graphiti.search(req.query, req.focal_node_uuid)
         else:
-            results = await graphiti.search(req.query)
-        
-        # Step 2: Build Neo4j filter query
-        filter_conditions = ["e.project_id = $project_id"]
-        filter_params = {"project_id": req.project_id}
-        
-        # TTL filter (only active memories)
-        filter_conditions.append("e.expires_at IS NOT NULL")
-        filter_conditions.append("datetime(e.expires_at) > datetime()")
-        
-        # Time window filter
-        if req.days_ago:
-            cutoff = datetime.utcnow() - timedelta(days=req.days_ago)
-            filter_conditions.append("e.created_at >= datetime($cutoff)")
-            filter_params["cutoff"] = cutoff.isoformat()
-        
-        # File filter
-        if req.file_filter:
-            filter_conditions.append("e.file_path = $file_path")
-            filter_params["file_path"] = req.file_filter
-        
-        # Function filter
-        if req.function_filter:
-            filter_conditions.append("e.function_name = $function_name")
-            filter_params["function_name"] = req.function_filter
-        
-        # Change type filter
-        if req.change_type_filter:
-            filter_conditions.append("e.change_type = $change_type")
-            filter_params["change_type"] = req.change_type_filter
-        
-        # Build complete query
-        where_clause = " AND ".join(filter_conditions)
-        query = f"""
-        MATCH (e:Entity)
-        WHERE {where_clause}
-        RETURN e.uuid as uuid,
-               e.summary as summary,
-               e.file_path as file_path,
-               e.function_name as function_name,
-               e.change_type as change_type,
-               e.change_summary as change_summary,
-               e.severity as severity,
-               e.code_after_id as code_after_id,
-               e.code_after_hash as code_after_hash,
-               e.diff_summary as diff_summary,
-               e.created_at as created_at
-        """
-        
-        # Execute filter query
-        valid_uuids = set()
-        entity_data = {}
-        
-        async with graphiti.driver.session() as session:
-            result = await session.run(query, filter_params)
-            async for record in result:
-                uuid = record["uuid"]
-                valid_uuids.add(uuid)
-                entity_data[uuid] = {
-                    "file_path": record.get("file_path"),
-                    "function_name": record.get("function_name"),
-                    "change_type": record.get("change_type"),
-                    "change_summary": record.get("change_summary"),
-                    "severity": record.get("severity"),
-                    "code_after_id": record.get("code_after_id"),
-                    "code_after_hash": record.get("code_after_hash"),
-                    "diff_summary": record.get("diff_summary"),
-                    "created_at": str(record.get("created_at")) if record.get("created_at") else None
-                }
+            search_coro = graphiti.search(req.query)
+        
+        # Step 2: Neo4j filter query — cố định, chỉ thay đổi params (plan cache của Neo4j dùng lại được)
+        cutoff = datetime.utcnow() - timedelta(days=req.days_ago) if req.days_ago else None
+        filter_params = {
+            "project_id": req.project_id,
+            "cutoff": _to_utc(cutoff) if cutoff else None,
+            "file_path": req.file_filter or None,
+            "function_name": req.function_filter or None,
+            "change_type": req.change_type_filter or None,
+        }
+        
+        async def fetch_entity_data():
+            entity_data = {}
+            async with graphiti.driver.session(database=NEO4J_DATABASE) as session:
+                result = await session.run(_CODE_FILTER_QUERY, filter_params)
+                async for record in result:
+                    entity_data[record["uuid"]] = {
+                        "file_path": record.get("file_path"),
+                        "function_name": record.get("function_name"),
+                        "change_type": record.get("change_type"),
+                        "change_summary": record.get("change_summary"),
+                        "severity": record.get("severity"),
+                        "code_after_id": record.get("code_after_id"),
+                        "code_after_hash": record.get("code_after_hash"),
+                        "diff_summary": record.get("diff_summary"),
+                        "created_at": str(record.get("created_at")) if record.get("created_at") else None
+                    }
+            return entity_data
+        
+        # Hai bước độc lập nhau - chạy song song thay vì tuần tự
+        results, entity_data = await asyncio.gather(search_coro, fetch_entity_data())
+        valid_uuids = entity_data.keys()
         
         logger.info(f"Project filter: {len(valid_uuids)} valid entities for project {req.project_id}")
         
@@ -863,14 +847,11 @@ async def manual_cleanup(graphiti=Depends(get_graphiti)):
     
     Deletes all entities past their 48-hour TTL.
     """
-    import logging
-    from app.graph import cleanup_expired_memories
-    
-    logger = logging.getLogger(__name__)
     
     try:
         logger.info("Manual cleanup triggered")
         deleted_count = await cleanup_expired_memories(graphiti)
+        invalidate_stats_cache()
         
         return {
             "deleted_count": deleted_count,
@@ -888,14 +869,17 @@ async def get_stats(project_id: str, graphiti=Depends(get_graphiti)):
     
     Returns counts of memories, files, and change types.
     """
-    import logging
-    from app.graph import get_project_stats
-    
-    logger = logging.getLogger(__name__)
     
     try:
+        # Stats thay đổi chậm - dùng cache TTL ngắn, bị xóa khi ingest/cleanup
+        cache_key = cache_project_stats(project_id)
+        cached_stats = memory_cache.get(cache_key)
+        if cached_stats is not None:
+            return cached_stats
+        
         logger.info(f"Getting stats for project {project_id}")
         stats = await get_project_stats(graphiti, project_id)
+        memory_cache.set(cache_key, stats, ttl=15)
         
         return stats
         
@@ -14,6 +14,7 @@ from app.schemas import (
     IngestCodeContext,
     SearchCodeRequest
 )
+from app.ai_helpers import to_json_bytes
 from datetime import datetime
 
 # =============================================================================
@@ -276,6 +277,13 @@ def example_json_serialization():
     print("As JSON:")
     print(json_str)
     print()
+    
+    # Compact bytes, ready to send as an HTTP request body
+    body = to_json_bytes(ingest)
+    print(f"As request body ({len(body)} bytes):")
+    print(body.decode("utf-8"))
+    print()
+    # requests.post("http://localhost:8000/ingest/code-context", data=body, headers={"Content-Type": "application/json"})
 
 # =============================================================================
 # Example 7: Real Conversation Flow
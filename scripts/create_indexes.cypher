@@ -16,6 +16,10 @@ CREATE INDEX entity_created_at IF NOT EXISTS FOR (n:Entity) ON (n.created_at);
 CREATE INDEX entity_group_id IF NOT EXISTS FOR (n:Entity) ON (n.group_id);
 CREATE INDEX episodic_created_at IF NOT EXISTS FOR (n:Episodic) ON (n.created_at);
 CREATE INDEX episodic_group_id IF NOT EXISTS FOR (n:Episodic) ON (n.group_id);
+// Composite (group_id, created_at): only used by queries that also constrain created_at
+// (export/debug add `e.created_at IS NOT NULL`, recent-entity lookup uses a range)
+CREATE INDEX entity_group_id_created_at IF NOT EXISTS FOR (n:Entity) ON (n.group_id, n.created_at);
+CREATE INDEX entity_project_id_expires_at IF NOT EXISTS FOR (n:Entity) ON (n.project_id, n.expires_at);
 
 // 4. Create vector index for embeddings
 CREATE VECTOR INDEX entity_name_embedding IF NOT EXISTS
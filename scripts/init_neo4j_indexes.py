@@ -41,9 +41,11 @@ async def main():
         # List created indexes
         print("Created indexes:")
         print("  1. entity_project_id - For project isolation queries")
-        print("  2. entity_expires_at - For TTL cleanup queries")
-        print("  3. entity_file_path - For file-based filtering")
-        print("  4. entity_change_type - For change type filtering")
+        print("  2. entity_project_id_expires_at - For active-memory filtering per project")
+        print("  3. entity_expires_at - For TTL cleanup queries")
+        print("  4. entity_file_path - For file-based filtering")
+        print("  5. entity_change_type - For change type filtering")
+        print("  6. entity_group_id_created_at - For group lookups ordered by time")
         print()
         
         print("=" * 60)
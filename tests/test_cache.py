@@ -0,0 +1,96 @@
+# tests/test_cache.py
+"""
+Unit tests for the in-memory LRU cache (MemoryCache)
+"""
+import pytest
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import app.cache as cache_module
+from app.cache import MemoryCache
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+def indexed_keys(cache: MemoryCache, prefix: str) -> set:
+    """Keys currently tracked in the prefix index for a prefix"""
+    return set(cache._prefix_index.get(prefix, set()))
+
+# =============================================================================
+# LRU Eviction Tests
+# =============================================================================
+
+def test_eviction_respects_recency_after_get():
+    """Test get() refreshes recency so the least recently used key is evicted"""
+    cache = MemoryCache(default_ttl=60, max_entries=3)
+    cache.set("search:a", 1)
+    cache.set("search:b", 2)
+    cache.set("search:c", 3)
+
+    # Touch "a" so "b" becomes the least recently used entry
+    assert cache.get("search:a") == 1
+    cache.set("search:d", 4)
+
+    assert cache.get("search:b") is None
+    assert cache.get("search:a") == 1
+    assert cache.get("search:c") == 3
+    assert cache.get("search:d") == 4
+    assert len(cache.cache) == 3
+
+def test_prefix_index_consistent_after_capacity_eviction():
+    """Test evicted keys are also removed from the prefix index"""
+    cache = MemoryCache(default_ttl=60, max_entries=2)
+    cache.set("search:a", 1)
+    cache.set("stats:p1", 2)
+    cache.set("search:b", 3)  # evicts "search:a"
+
+    assert "search:a" not in cache.cache
+    assert indexed_keys(cache, "search") == {"search:b"}
+    assert indexed_keys(cache, "stats") == {"stats:p1"}
+
+    # Every indexed key is present in the cache and vice versa
+    all_indexed = set().union(*cache._prefix_index.values())
+    assert all_indexed == set(cache.cache)
+
+# =============================================================================
+# Prefix Index Tests
+# =============================================================================
+
+def test_delete_prefix_removes_only_matching_keys():
+    """Test delete_prefix removes exactly the keys of that prefix"""
+    cache = MemoryCache(default_ttl=60)
+    cache.set("search:a", 1)
+    cache.set("search:b", 2)
+    cache.set("stats:p1", 3)
+    cache.set("searchable:x", 4)  # Different prefix despite sharing characters
+
+    cache.delete_prefix("search")
+
+    assert set(cache.cache) == {"stats:p1", "searchable:x"}
+    assert indexed_keys(cache, "search") == set()
+    assert indexed_keys(cache, "stats") == {"stats:p1"}
+    assert indexed_keys(cache, "searchable") == {"searchable:x"}
+
+def test_expired_entry_removed_by_get_leaves_prefix_index(monkeypatch):
+    """Test an expired entry dropped by get() is also dropped from the prefix index"""
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+
+    cache = MemoryCache(default_ttl=60)
+    cache.set("stats:p1", {"total": 1}, ttl=10)
+    cache.set("stats:p2", {"total": 2}, ttl=100)
+
+    now[0] += 30
+    assert cache.get("stats:p1") is None
+
+    assert "stats:p1" not in cache.cache
+    assert indexed_keys(cache, "stats") == {"stats:p2"}
+    assert cache.get("stats:p2") == {"total": 2}
+
+if __name__ == "__main__":
+    # Run with: python -m pytest tests/test_cache.py -v
+    pytest.main([__file__, "-v"])
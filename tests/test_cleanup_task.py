@@ -0,0 +1,107 @@
+# tests/test_cleanup_task.py
+"""
+Unit tests for the periodic TTL cleanup started by the app lifespan
+"""
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import Mock, AsyncMock
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import app.main as main_module
+
+# =============================================================================
+# Test Fixtures
+# =============================================================================
+
+@pytest.fixture
+def mock_cleanup(monkeypatch):
+    """Patch the Neo4j-facing calls used by the lifespan and the cleanup loop"""
+    cleanup = AsyncMock(return_value=3)
+    monkeypatch.setattr(main_module, "get_graphiti", AsyncMock(return_value=Mock()))
+    monkeypatch.setattr(main_module, "create_indexes", AsyncMock())
+    monkeypatch.setattr(main_module, "normalize_expires_at", AsyncMock(return_value=0))
+    monkeypatch.setattr(main_module, "cleanup_expired_memories", cleanup)
+    monkeypatch.setattr(main_module, "invalidate_stats_cache", Mock())
+    return cleanup
+
+async def wait_for_calls(mock, count=1, timeout=1.0):
+    """Wait until an AsyncMock has been awaited at least `count` times"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while mock.await_count < count and loop.time() < deadline:
+        await asyncio.sleep(0.005)
+
+# =============================================================================
+# Periodic Cleanup Tests
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_periodic_cleanup_calls_cleanup_and_stops_on_cancel(mock_cleanup, monkeypatch):
+    """Test the loop calls cleanup_expired_memories and exits when cancelled"""
+    monkeypatch.setattr(main_module, "CLEANUP_INTERVAL_SECONDS", 0.01)
+
+    task = asyncio.create_task(main_module._periodic_cleanup())
+    await wait_for_calls(mock_cleanup, count=2)
+
+    assert mock_cleanup.await_count >= 2
+    main_module.invalidate_stats_cache.assert_called()
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert task.cancelled()
+
+@pytest.mark.asyncio
+async def test_periodic_cleanup_survives_failures(mock_cleanup, monkeypatch):
+    """Test a failing sweep is logged and the loop keeps running"""
+    monkeypatch.setattr(main_module, "CLEANUP_INTERVAL_SECONDS", 0.01)
+    mock_cleanup.side_effect = RuntimeError("Neo4j unavailable")
+
+    task = asyncio.create_task(main_module._periodic_cleanup())
+    await wait_for_calls(mock_cleanup, count=2)
+
+    assert mock_cleanup.await_count >= 2
+    assert not task.done()
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+# =============================================================================
+# Lifespan Tests
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_lifespan_starts_and_cancels_cleanup_task(mock_cleanup, monkeypatch):
+    """Test the lifespan creates indexes, runs the sweep and stops it on shutdown"""
+    monkeypatch.setattr(main_module, "CLEANUP_INTERVAL_SECONDS", 0.01)
+    app = Mock()
+
+    async with main_module.lifespan(app):
+        task = app.state.cleanup_task
+        assert task is not None
+        await wait_for_calls(mock_cleanup)
+        assert mock_cleanup.await_count >= 1
+
+    main_module.create_indexes.assert_awaited_once()
+    assert task.cancelled()
+
+@pytest.mark.asyncio
+async def test_lifespan_skips_cleanup_when_interval_is_zero(mock_cleanup, monkeypatch):
+    """Test no cleanup task is started when CLEANUP_INTERVAL_SECONDS is 0"""
+    monkeypatch.setattr(main_module, "CLEANUP_INTERVAL_SECONDS", 0)
+    app = Mock()
+
+    async with main_module.lifespan(app):
+        assert app.state.cleanup_task is None
+
+    main_module.create_indexes.assert_awaited_once()
+    mock_cleanup.assert_not_called()
+
+if __name__ == "__main__":
+    # Run with: python -m pytest tests/test_cleanup_task.py -v
+    pytest.main([__file__, "-v"])
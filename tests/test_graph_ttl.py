@@ -5,7 +5,7 @@ Unit tests for Neo4j TTL and code metadata functions (Phase 2)
 import pytest
 import sys
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from unittest.mock import Mock, AsyncMock, MagicMock, patch
 
 # Add parent directory to path
@@ -17,7 +17,10 @@ from app.graph import (
     cleanup_expired_memories,
     create_indexes,
     get_project_stats,
-    _set_entity_ttl
+    normalize_expires_at,
+    _set_entity_ttl,
+    _set_entities_ttl,
+    _created_entity_uuids
 )
 
 # =============================================================================
@@ -111,7 +114,34 @@ async def test_add_episode_with_ttl_sets_expiration(mock_graphiti):
     
     # Verify TTL was set
     mock_session.run.assert_called()
-    
+
+@pytest.mark.asyncio
+async def test_add_episode_with_ttl_batches_entities(mock_graphiti):
+    """Test that TTL for all created entities is written in one query"""
+    entities = [Mock(uuid=f"entity_{i}") for i in range(3)]
+    mock_episode = Mock()
+    mock_episode.created_entities = entities
+    mock_graphiti.add_episode = AsyncMock(return_value=mock_episode)
+
+    mock_session = AsyncMock()
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+    mock_session.run = AsyncMock()
+
+    await add_episode_with_ttl(
+        graphiti=mock_graphiti,
+        episode_body="Test",
+        source_description="test",
+        reference_time=datetime.utcnow(),
+        group_id="project_test"
+    )
+
+    mock_session.run.assert_called_once()
+    query, params = mock_session.run.call_args[0]
+    assert "UNWIND" in query
+    assert params["uuids"] == ["entity_0", "entity_1", "entity_2"]
+
 @pytest.mark.asyncio
 async def test_set_entity_ttl(mock_graphiti):
     """Test _set_entity_ttl function"""
@@ -138,6 +168,67 @@ async def test_set_entity_ttl(mock_graphiti):
     assert params["uuid"] == entity_uuid
     assert params["project_id"] == project_id
 
+@pytest.mark.asyncio
+async def test_set_entities_ttl_single_round_trip(mock_graphiti):
+    """Test _set_entities_ttl updates all entities with one UNWIND query"""
+    mock_session = AsyncMock()
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+    mock_session.run = AsyncMock()
+    
+    uuids = ["uuid_1", "uuid_2", "uuid_3"]
+    expires_at = datetime.utcnow() + timedelta(hours=48)
+    
+    await _set_entities_ttl(mock_graphiti, uuids, expires_at, "test_project")
+    
+    mock_session.run.assert_called_once()
+    query, params = mock_session.run.call_args[0]
+    assert "UNWIND $uuids" in query
+    assert params["uuids"] == uuids
+    assert params["project_id"] == "test_project"
+    # Passed as a native (timezone-aware) datetime, not an ISO string
+    assert params["expires_at"] == expires_at.replace(tzinfo=timezone.utc).isoformat()
+    assert datetime.fromisoformat(params["expires_at"]).tzinfo is not None
+
+@pytest.mark.asyncio
+async def test_set_entities_ttl_empty(mock_graphiti):
+    """Test _set_entities_ttl skips the query when there is nothing to update"""
+    mock_graphiti.driver.session = MagicMock()
+    
+    await _set_entities_ttl(mock_graphiti, [], datetime.utcnow(), "test_project")
+    
+    mock_graphiti.driver.session.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_set_entity_ttl_reuses_session(mock_graphiti):
+    """Test _set_entity_ttl runs on a caller-provided session"""
+    mock_graphiti.driver.session = MagicMock()
+    shared_session = AsyncMock()
+    shared_session.run = AsyncMock()
+    
+    await _set_entity_ttl(
+        mock_graphiti, "uuid_1", datetime.utcnow(), "test_project", session=shared_session
+    )
+    
+    shared_session.run.assert_called_once()
+    mock_graphiti.driver.session.assert_not_called()
+
+def test_created_entity_uuids_skips_preexisting_nodes():
+    """Test entities deduplicated into the episode are not stamped with a TTL"""
+    ingest_started = datetime(2026, 1, 2, 12, 0, 0, tzinfo=timezone.utc)
+    nodes = [
+        # Long-lived entity that add_episode resolved to an existing node
+        Mock(uuid="existing", created_at=datetime(2025, 6, 1, tzinfo=timezone.utc)),
+        Mock(uuid="new-1", created_at=ingest_started + timedelta(seconds=3)),
+        # Naive created_at is treated as UTC
+        Mock(uuid="new-2", created_at=datetime(2026, 1, 2, 12, 0, 5)),
+        Mock(uuid="no-created-at", created_at=None),
+    ]
+
+    assert _created_entity_uuids(nodes, ingest_started) == ["new-1", "new-2"]
+    assert _created_entity_uuids(None, ingest_started) == []
+
 # =============================================================================
 # Code Metadata Tests
 # =============================================================================
@@ -205,6 +296,91 @@ async def test_add_code_metadata_partial(mock_graphiti):
     assert result == {"file_path": "test.py"}
     mock_session.run.assert_called_once()
 
+    # Fields are sent as one map so the query text does not depend on them
+    query, params = mock_session.run.call_args[0]
+    assert "SET e += $props" in query
+    assert params["props"] == partial_metadata
+
+@pytest.mark.asyncio
+async def test_add_code_metadata_without_return(mock_graphiti):
+    """Test add_code_metadata only returns a match count when return_entity=False"""
+    mock_session = AsyncMock()
+    mock_result = AsyncMock()
+    mock_result.single = AsyncMock(return_value={"matched": 1})
+    mock_session.run = AsyncMock(return_value=mock_result)
+    
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+    
+    result = await add_code_metadata(
+        graphiti=mock_graphiti,
+        entity_uuid="test_uuid",
+        metadata={"file_path": "test.py"},
+        return_entity=False
+    )
+    
+    assert result == {"file_path": "test.py"}
+    query = mock_session.run.call_args[0][0]
+    assert "RETURN count(e) AS matched" in query
+    assert "RETURN e" not in query
+
+@pytest.mark.asyncio
+async def test_add_code_metadata_with_ttl_single_query(mock_graphiti):
+    """Test add_code_metadata sets TTL for ttl_uuids in the same query"""
+    mock_session = AsyncMock()
+    mock_result = AsyncMock()
+    mock_result.single = AsyncMock(return_value={"matched": 1})
+    mock_session.run = AsyncMock(return_value=mock_result)
+    
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+    
+    result = await add_code_metadata(
+        graphiti=mock_graphiti,
+        entity_uuid="uuid_1",
+        metadata={"file_path": "test.py"},
+        return_entity=False,
+        ttl_uuids=["uuid_1", "uuid_2"],
+        expires_at=datetime.utcnow() + timedelta(hours=48),
+        project_id="test_project"
+    )
+    
+    assert result == {"file_path": "test.py"}
+    mock_session.run.assert_called_once()
+    query, params = mock_session.run.call_args[0]
+    assert "UNWIND $ttl_uuids" in query
+    assert "t.expires_at" in query
+    assert params["ttl_uuids"] == ["uuid_1", "uuid_2"]
+    assert params["project_id"] == "test_project"
+
+@pytest.mark.asyncio
+async def test_add_code_metadata_with_ttl_missing_entity(mock_graphiti):
+    """Test a missing target entity is detected even when TTL rows were updated"""
+    mock_session = AsyncMock()
+    mock_result = AsyncMock()
+    # TTL SETs succeeded (properties_set > 0) but the metadata target did not match
+    mock_result.consume = AsyncMock(return_value=Mock(**{"counters.properties_set": 4}))
+    mock_result.single = AsyncMock(return_value={"matched": 0})
+    mock_session.run = AsyncMock(return_value=mock_result)
+    
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+    
+    result = await add_code_metadata(
+        graphiti=mock_graphiti,
+        entity_uuid="missing_uuid",
+        metadata={"file_path": "test.py"},
+        return_entity=False,
+        ttl_uuids=["uuid_1", "uuid_2"],
+        expires_at=datetime.utcnow() + timedelta(hours=48),
+        project_id="test_project"
+    )
+    
+    assert result == {}
+
 # =============================================================================
 # Cleanup Tests
 # =============================================================================
@@ -259,9 +435,15 @@ async def test_cleanup_expired_memories_none_expired(mock_graphiti):
 
 @pytest.mark.asyncio
 async def test_create_indexes(mock_graphiti):
-    """Test create_indexes creates all required indexes"""
+    """Test create_indexes creates all required indexes in one transaction"""
     mock_session = AsyncMock()
     mock_session.run = AsyncMock()
+    mock_tx = AsyncMock()
+    mock_tx.run = AsyncMock(return_value=AsyncMock())
+    
+    async def run_work(work):
+        return await work(mock_tx)
+    mock_session.execute_write = AsyncMock(side_effect=run_work)
     
     mock_graphiti.driver.session = MagicMock(return_value=mock_session)
     mock_session.__aenter__ = AsyncMock(return_value=mock_session)
@@ -269,15 +451,36 @@ async def test_create_indexes(mock_graphiti):
     
     await create_indexes(mock_graphiti)
     
-    # Verify multiple index creation queries
-    assert mock_session.run.call_count == 4  # 4 indexes
+    # Verify multiple index creation queries, all inside the single write transaction
+    mock_session.execute_write.assert_called_once()
+    mock_session.run.assert_not_called()
+    assert mock_tx.run.call_count == 6  # 6 indexes
     
     # Verify index names appear in queries
-    calls = [call[0][0] for call in mock_session.run.call_args_list]
-    assert any("entity_project_id" in call for call in calls)
+    calls = [call[0][0] for call in mock_tx.run.call_args_list]
+    # Single-column project_id index is kept alongside the composite one
+    assert any("entity_project_id IF NOT EXISTS" in call and "ON (n.project_id)" in call for call in calls)
+    assert any("entity_project_id_expires_at" in call and "n.project_id, n.expires_at" in call for call in calls)
+    assert not any("DROP INDEX" in call for call in calls)
     assert any("entity_expires_at" in call for call in calls)
     assert any("entity_file_path" in call for call in calls)
     assert any("entity_change_type" in call for call in calls)
+    assert any("entity_group_id_created_at" in call and "n.group_id, n.created_at" in call for call in calls)
+
+@pytest.mark.asyncio
+async def test_create_indexes_falls_back_to_individual_statements(mock_graphiti):
+    """Test create_indexes retries statements one by one if the batch fails"""
+    mock_session = AsyncMock()
+    mock_session.run = AsyncMock()
+    mock_session.execute_write = AsyncMock(side_effect=Exception("schema tx failed"))
+    
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+    
+    await create_indexes(mock_graphiti)
+    
+    assert mock_session.run.call_count == 6
 
 # =============================================================================
 # Statistics Tests
@@ -286,8 +489,6 @@ async def test_create_indexes(mock_graphiti):
 @pytest.mark.asyncio
 async def test_get_project_stats_with_data(mock_graphiti):
     """Test get_project_stats with existing data"""
-    mock_session = AsyncMock()
-    mock_result = AsyncMock()
     mock_record = {
         "active_count": 10,
         "expired_count": 3,
@@ -295,15 +496,14 @@ async def test_get_project_stats_with_data(mock_graphiti):
         "change_types": ["fixed", "added", "refactored"]
     }
     
-    mock_result.single = AsyncMock(return_value=mock_record)
-    mock_session.run = AsyncMock(return_value=mock_result)
-    
-    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
-    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
-    mock_session.__aexit__ = AsyncMock(return_value=None)
+    mock_graphiti.driver.execute_query = AsyncMock(return_value=([mock_record], Mock(), []))
     
     stats = await get_project_stats(mock_graphiti, "test_project")
     
+    # Read routed through driver.execute_query with the project as a parameter
+    mock_graphiti.driver.execute_query.assert_called_once()
+    assert mock_graphiti.driver.execute_query.call_args.kwargs["project_id"] == "test_project"
+    
     assert stats["project_id"] == "test_project"
     assert stats["total_memories"] == 10
     assert stats["expired_memories"] == 3
@@ -313,14 +513,7 @@ async def test_get_project_stats_with_data(mock_graphiti):
 @pytest.mark.asyncio
 async def test_get_project_stats_empty_project(mock_graphiti):
     """Test get_project_stats with no data"""
-    mock_session = AsyncMock()
-    mock_result = AsyncMock()
-    mock_result.single = AsyncMock(return_value=None)
-    mock_session.run = AsyncMock(return_value=mock_result)
-    
-    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
-    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
-    mock_session.__aexit__ = AsyncMock(return_value=None)
+    mock_graphiti.driver.execute_query = AsyncMock(return_value=([], Mock(), []))
     
     stats = await get_project_stats(mock_graphiti, "empty_project")
     
@@ -330,6 +523,74 @@ async def test_get_project_stats_empty_project(mock_graphiti):
     assert stats["files_count"] == 0
     assert stats["change_types"] == []
 
+# =============================================================================
+# Graphiti Construction Tests
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_get_graphiti_uses_configured_database(monkeypatch):
+    """Test Graphiti's own driver targets NEO4J_DATABASE like the app's queries"""
+    import app.graph as graph
+    
+    mock_driver_cls = MagicMock()
+    mock_graphiti_cls = MagicMock()
+    monkeypatch.setattr(graph, "Neo4jDriver", mock_driver_cls)
+    monkeypatch.setattr(graph, "Graphiti", mock_graphiti_cls)
+    monkeypatch.setattr(graph, "_install_tuned_driver", AsyncMock())
+    monkeypatch.setattr(graph, "NEO4J_DATABASE", "memory_db")
+    graph.reset_graphiti_cache()
+    
+    try:
+        result = await graph.get_graphiti()
+    finally:
+        graph.reset_graphiti_cache()
+    
+    assert result is mock_graphiti_cls.return_value
+    assert mock_driver_cls.call_args.kwargs["database"] == "memory_db"
+    assert mock_graphiti_cls.call_args.kwargs["graph_driver"] is mock_driver_cls.return_value
+
+# =============================================================================
+# expires_at Serialization Tests
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_ttl_written_as_iso_string_graphiti_can_serialize(mock_graphiti):
+    """Test expires_at is stored as an ISO string so graphiti's json.dumps handles it"""
+    import json
+    mock_session = AsyncMock()
+    mock_session.run = AsyncMock()
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+
+    await _set_entities_ttl(mock_graphiti, ["uuid_1"], datetime(2026, 1, 3, 12, 0, 0), "test_project")
+
+    params = mock_session.run.call_args[0][1]
+    assert params["expires_at"] == "2026-01-03T12:00:00+00:00"
+    # Graphiti reads entity properties back into attributes and json.dumps them
+    attributes = {"project_id": "test_project", "expires_at": params["expires_at"]}
+    assert "2026-01-03T12:00:00+00:00" in json.dumps(attributes)
+    prompt_helpers = pytest.importorskip("graphiti_core.prompts.prompt_helpers")
+    assert "2026-01-03T12:00:00+00:00" in prompt_helpers.to_prompt_json(attributes)
+
+@pytest.mark.asyncio
+async def test_normalize_expires_at(mock_graphiti):
+    """Test legacy DateTime expires_at values are converted in one query"""
+    mock_session = AsyncMock()
+    mock_result = AsyncMock()
+    mock_result.single = AsyncMock(return_value={"converted_count": 4})
+    mock_session.run = AsyncMock(return_value=mock_result)
+    mock_graphiti.driver.session = MagicMock(return_value=mock_session)
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+
+    converted = await normalize_expires_at(mock_graphiti)
+
+    assert converted == 4
+    mock_session.run.assert_called_once()
+    query = mock_session.run.call_args[0][0]
+    assert "SET e.expires_at = toString(e.expires_at)" in query
+
 # =============================================================================
 # Integration-like Tests
 # =============================================================================